@@ -1,23 +1,99 @@
-import os, sqlite3, smtplib
-from datetime import datetime
+import os, sqlite3, smtplib, queue, threading, atexit, hashlib, hmac, mimetypes, uuid, json
+from contextlib import contextmanager
 from email.message import EmailMessage
+from urllib.parse import quote
 import cloudinary
 import cloudinary.uploader
-import zipfile, tempfile, shutil
-from flask import Flask, abort, flash, redirect, render_template, request, send_from_directory, url_for, session
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, abort, flash, make_response, redirect, render_template, request, send_from_directory, url_for, session
 import flask
+from flask_caching import Cache
+from flask_compress import Compress
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "store.db")
+DB_PATH = os.getenv("DB_PATH") or os.path.join(BASE_DIR, "store.db")
 UPLOAD_DIR = os.path.join(BASE_DIR, "static", "uploads")
-ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp", "gif"}
+ALLOWED_EXTENSIONS = frozenset({"png", "jpg", "jpeg", "webp", "gif"})
+_ALLOWED_SUFFIXES = tuple("." + e for e in ALLOWED_EXTENSIONS)
+UPLOAD_SAVE_WORKERS = 4
+CDN_UPLOAD_WORKERS = 8
+SMTP_TIMEOUT = 30
+CDN_LARGE_UPLOAD = 20 * 1024 * 1024  # daarboven in stukken uploaden (upload_large)
+UPLOAD_COPY_BUFSIZE = 1024 * 1024
+UPLOAD_MAX_AGE = 365 * 24 * 3600
+THUMB_SIZE = (600, 600)
 
 load_dotenv()
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.getenv("SECRET_KEY", "dev-key")
 app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
+def _smtp_port():
+    # een typefout in SMTP_PORT mag de site niet platleggen: dan alleen geen e-mail
+    try:
+        return int(os.getenv("SMTP_PORT") or 0)
+    except ValueError:
+        print("SMTP_PORT ongeldig:", os.getenv("SMTP_PORT"), "- e-mail staat uit.")
+        return 0
+
+# e-mailinstellingen één keer inlezen i.p.v. os.getenv per mail
+app.config.update(
+    SMTP_SERVER=os.getenv("SMTP_SERVER"),
+    SMTP_PORT=_smtp_port(),
+    SMTP_USERNAME=os.getenv("SMTP_USERNAME"),
+    SMTP_PASSWORD=os.getenv("SMTP_PASSWORD"),
+    FROM_EMAIL=os.getenv("FROM_EMAIL"),
+    ADMIN_EMAIL=os.getenv("ADMIN_EMAIL"),
+)
+app.config["EMAIL_ENABLED"] = all(app.config[k] for k in
+                                  ("SMTP_SERVER", "SMTP_PORT", "SMTP_USERNAME", "SMTP_PASSWORD", "FROM_EMAIL", "ADMIN_EMAIL"))
+# admin-wachtwoord één keer hashen; bij login vergelijken we in constante tijd
+ADMIN_PW_HASH = hashlib.sha256(os.getenv("ADMIN_PASSWORD", "").encode()).digest()
+
+# --- Cache voor de publieke collectiepagina ---
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 60})
+INDEX_CACHE_KEY = "view/index"
+_index_generation = 0
+# HTML/CSS/JS gecomprimeerd versturen (gzip/br); afbeeldingen laat Flask-Compress met rust
+Compress(app)
+
+def _has_pending_flash():
+    # pagina's met een flash-melding nooit uit (of in) de cache serveren
+    return "_flashes" in session
+
+def _index_cache_key():
+    # de pagina bevat absolute URL's (og:url, og:image) op basis van de Host-header: per host cachen,
+    # anders bepaalt één request met een vreemde Host wat iedereen te zien krijgt
+    return f"{INDEX_CACHE_KEY}/{_index_generation}/{request.host_url}"
+
+def invalidate_index_cache():
+    # nieuwe generatie = nieuwe sleutels voor alle hosts; oude entries verlopen vanzelf (TTL)
+    global _index_generation
+    _index_generation += 1
+
+@app.template_filter("cdn_auto")
+def cdn_auto(url):
+    # Cloudinary-URL: laat de CDN zelf formaat (WebP/AVIF) en kwaliteit kiezen
+    if "res.cloudinary.com" in url and "/image/upload/" in url and "/image/upload/f_auto" not in url:
+        return url.replace("/image/upload/", "/image/upload/f_auto,q_auto/", 1)
+    return url
+
+@app.template_global()
+def upload_url(filename):
+    # met UPLOAD_PUBLIC_BASE serveert Nginx/CDN de uploads direct; anders via uploaded_file
+    base = app.config["UPLOAD_PUBLIC_BASE"]
+    if base:
+        return base.rstrip("/") + "/" + quote(filename)
+    return url_for("uploaded_file", filename=filename)
+
+@app.template_filter("upload_src")
+def upload_src(fn):
+    s = str(fn)
+    return cdn_auto(s) if s.startswith(("http://", "https://")) else upload_url(s)
 
 @app.context_processor
 def _img_helpers():
@@ -27,11 +103,11 @@ def _img_helpers():
             return url_for('static', filename='placeholder.png')
         s = str(fn)
         if s.startswith('http://') or s.startswith('https://'):
-            return s
+            return cdn_auto(s)
         # lokaal uploadpad
         candidate = os.path.join(app.config["UPLOAD_FOLDER"], s)
         if os.path.exists(candidate):
-            return url_for('uploaded_file', filename=s)
+            return upload_url(s)
         # fallback
         return url_for('static', filename='placeholder.png')
     return dict(img_src=img_src)
@@ -41,171 +117,460 @@ def _img_helpers():
 cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
 api_key    = os.getenv("CLOUDINARY_API_KEY")
 api_secret = os.getenv("CLOUDINARY_API_SECRET")
-if cloud_name and api_key and api_secret:
+CDN_ENABLED = bool(cloud_name and api_key and api_secret)
+if CDN_ENABLED:
     cloudinary.config(cloud_name=cloud_name, api_key=api_key, api_secret=api_secret, secure=True)
 else:
     print("Cloudinary niet geconfigureerd (missing env vars). Uploads vallen terug op lokaal pad.")
 
+class _KeepOpen:
+    # upload_large sluit de stream na afloop; de lokale terugval moet hem daarna nog kunnen lezen
+    def __init__(self, stream):
+        self._stream = stream
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
 def upload_to_cdn(file_storage, public_id_prefix="nofa"):
     try:
-        if not (cloud_name and api_key and api_secret):
+        if not CDN_ENABLED:
             return None  # geen Cloudinary, caller kan lokaal opslaan
-        # file_storage: werkzeug FileStorage
-        res = cloudinary.uploader.upload(
-            file_storage,
-            folder=public_id_prefix,
-            resource_type="image",
-            overwrite=False
-        )
+        # file_storage: werkzeug FileStorage; de stream (gespoold naar schijf) gaat rechtstreeks mee
+        stream = file_storage.stream
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        options = dict(folder=public_id_prefix, resource_type="image", overwrite=False, filename=file_storage.filename)
+        if size > CDN_LARGE_UPLOAD:
+            # grote bestanden in stukken van 20MB i.p.v. in één keer in het geheugen
+            res = cloudinary.uploader.upload_large(_KeepOpen(stream), **options)
+        else:
+            res = cloudinary.uploader.upload(stream, **options)
         return res.get("secure_url") or res.get("url")
     except Exception as e:
         print("Cloudinary upload fout:", e)
         return None
 
 app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024  # 200MB
+# achter Apache/lighttpd: laat de webserver de uploads zelf versturen (X-Sendfile)
+app.config["USE_X_SENDFILE"] = os.getenv("USE_X_SENDFILE", "").lower() in ("1", "true", "yes")
+# achter Nginx: interne location voor de uploads (bv. /internal_uploads/), zie README
+app.config["UPLOAD_ACCEL_PREFIX"] = os.getenv("UPLOAD_ACCEL_PREFIX", "")
+# publieke basis-URL voor de uploads (bv. https://static.example.com/uploads); leeg = via Flask
+app.config["UPLOAD_PUBLIC_BASE"] = os.getenv("UPLOAD_PUBLIC_BASE", "")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# --- SQLite connection pool ---
+DB_POOL_SIZE = 5
+
+def _connect_db():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
     conn.row_factory = sqlite3.Row
+    # eenmalig per verbinding, niet per request (journal_mode=WAL staat in het db-bestand, zie init_db)
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA cache_size=-20000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA foreign_keys=ON")
     return conn
 
+_db_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+for _ in range(DB_POOL_SIZE):
+    _db_pool.put(_connect_db())
+
+@contextmanager
+def get_db():
+    conn = _db_pool.get()
+    try:
+        yield conn
+    finally:
+        # nooit een half-open transactie teruggeven aan de pool
+        if conn.in_transaction:
+            conn.rollback()
+        _db_pool.put(conn)
+
+# --- Vaste SQL-teksten: identieke strings laten SQLite's statement cache het werk doen ---
+SQL_INDEX_CATALOG = ("SELECT product_id AS id, title, price_start, image_filename, cover_filename, img_count, highest_bid, is_sold "
+                     "FROM catalog ORDER BY is_sold ASC, created_at DESC")
+SQL_PRODUCT = "SELECT * FROM products WHERE id=?"
+# productpagina: product, foto's en biedingen in één query (lijsten als JSON-array)
+SQL_PRODUCT_DETAIL = """
+  SELECT p.*,
+    (SELECT json_group_array(json_object('id', id, 'filename', filename, 'thumb_filename', thumb_filename))
+       FROM (SELECT id, filename, thumb_filename FROM product_images WHERE product_id=p.id ORDER BY sort_order, id)) AS images_json,
+    (SELECT json_group_array(json_object('name', name, 'amount', amount, 'created_at', created_at))
+       FROM (SELECT name, amount, created_at FROM bids WHERE product_id=p.id ORDER BY amount DESC, created_at ASC)) AS bids_json
+  FROM products p WHERE p.id=?"""
+SQL_MAX_BID = "SELECT MAX(amount) as max_amount FROM bids WHERE product_id=?"
+# bod alleen opslaan als het hoger is dan het huidige hoogste bod (of de startprijs): controle en INSERT in één statement
+SQL_INSERT_BID = ("INSERT INTO bids (product_id, name, email, amount, created_at) "
+                  "SELECT ?, ?, ?, ?, strftime('%Y-%m-%dT%H:%M:%f','now') "
+                  "WHERE ? > COALESCE((SELECT MAX(amount) FROM bids WHERE product_id=?), "
+                  "(SELECT price_start FROM products WHERE id=?))")
+SQL_INSERT_PRODUCT = "INSERT INTO products (title, description, price_start, image_filename, created_at) VALUES (?,?,?,?,strftime('%Y-%m-%dT%H:%M:%f','now'))"
+SQL_INSERT_PRODUCT_IMAGE = "INSERT INTO product_images (product_id, filename, thumb_filename, sort_order, created_at) VALUES (?,?,?,?,strftime('%Y-%m-%dT%H:%M:%f','now'))"
+# sort_order = hoogste bestaande + 1, berekend in dezelfde INSERT
+SQL_APPEND_PRODUCT_IMAGE = ("INSERT INTO product_images (product_id, filename, thumb_filename, sort_order, created_at) "
+                            "SELECT ?, ?, ?, COALESCE(MAX(sort_order) + 1, 0), strftime('%Y-%m-%dT%H:%M:%f','now') "
+                            "FROM product_images WHERE product_id=?")
+SQL_ADMIN_PRODUCTS = "SELECT * FROM products ORDER BY created_at DESC"
+SQL_ADMIN_BIDS = "SELECT * FROM bids ORDER BY product_id, amount DESC"
+
 def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        title TEXT NOT NULL,
-        description TEXT,
-        price_start REAL NOT NULL,
-        image_filename TEXT,
-        is_sold INTEGER DEFAULT 0,
-        created_at TEXT NOT NULL
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS bids (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        product_id INTEGER NOT NULL,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL,
-        amount REAL NOT NULL,
-        created_at TEXT NOT NULL,
-        FOREIGN KEY(product_id) REFERENCES products(id)
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS product_images (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        product_id INTEGER NOT NULL,
-        filename TEXT NOT NULL,
-        sort_order INTEGER DEFAULT 0,
-        created_at TEXT NOT NULL,
-        FOREIGN KEY(product_id) REFERENCES products(id)
-    )""")
-    conn.commit()
-
-    # migratie legacy cover -> product_images
-    legacy = conn.execute("""
-      SELECT p.id, p.image_filename
-      FROM products p
-      LEFT JOIN product_images pi ON pi.product_id = p.id
-      WHERE pi.id IS NULL AND p.image_filename IS NOT NULL AND p.image_filename != ''
-    """).fetchall()
-    for row in legacy:
-        conn.execute("INSERT INTO product_images (product_id, filename, sort_order, created_at) VALUES (?,?,?,?)",
-                     (row["id"], row["image_filename"], 0, datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
+    with get_db() as conn:
+        # WAL is een eigenschap van het databasebestand: één keer zetten is genoeg
+        conn.execute("PRAGMA journal_mode=WAL")
+        cur = conn.cursor()
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT NOT NULL,
+            description TEXT,
+            price_start REAL NOT NULL,
+            image_filename TEXT,
+            is_sold INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS bids (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL,
+            amount REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )""")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS product_images (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            thumb_filename TEXT,
+            sort_order INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL,
+            FOREIGN KEY(product_id) REFERENCES products(id)
+        )""")
+        # bestaande databases: kolom voor de thumbnail bijmaken
+        pi_cols = {r["name"] for r in cur.execute("PRAGMA table_info(product_images)").fetchall()}
+        if "thumb_filename" not in pi_cols:
+            try:
+                cur.execute("ALTER TABLE product_images ADD COLUMN thumb_filename TEXT")
+            except sqlite3.OperationalError:
+                pass  # een andere worker was ons net voor
+        # indexen voor de hoogste-bod lookups, de biedlijst per product en de sorteringen
+        # (bids: created_at erbij zodat ook "amount DESC, created_at ASC" zonder sortering gaat)
+        cur.execute("DROP INDEX IF EXISTS idx_bids_product_amount")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_bids_product_amount_created ON bids(product_id, amount DESC, created_at)")
+        # de collectiepagina leest uit catalog (idx_catalog_sold_created); deze index gebruikt geen query meer
+        cur.execute("DROP INDEX IF EXISTS idx_products_sold_created")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_created ON products(created_at DESC)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_pi_product_sort ON product_images(product_id, sort_order, id)")
+
+        # catalog: één rij per product met alles wat de collectiepagina toont, bijgehouden door triggers
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog (
+            product_id INTEGER PRIMARY KEY,
+            title TEXT NOT NULL,
+            price_start REAL NOT NULL,
+            image_filename TEXT,
+            cover_filename TEXT,
+            img_count INTEGER NOT NULL DEFAULT 0,
+            highest_bid REAL,
+            is_sold INTEGER DEFAULT 0,
+            created_at TEXT NOT NULL
+        )""")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_catalog_sold_created ON catalog(is_sold, created_at DESC)")
+        cur.executescript("""
+        -- ON DELETE CASCADE zonder de tabellen om te bouwen: een product neemt zijn biedingen en foto's mee.
+        -- AFTER i.p.v. BEFORE: de cover-triggers mogen de rij die verwijderd wordt niet meer aanpassen
+        -- (FK-controle gebeurt pas aan het eind van het statement)
+        DROP TRIGGER IF EXISTS trg_products_cascade_del;
+        CREATE TRIGGER IF NOT EXISTS trg_products_cascade_after_del AFTER DELETE ON products BEGIN
+            DELETE FROM bids WHERE product_id=OLD.id;
+            DELETE FROM product_images WHERE product_id=OLD.id;
+        END;
+        -- hoofdfoto (products.image_filename) volgt altijd de eerste afbeelding
+        CREATE TRIGGER IF NOT EXISTS trg_products_cover_ins AFTER INSERT ON product_images BEGIN
+            UPDATE products SET image_filename=(SELECT filename FROM product_images
+                                                WHERE product_id=NEW.product_id ORDER BY sort_order, id LIMIT 1)
+            WHERE id=NEW.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_cover_upd AFTER UPDATE OF filename, sort_order, product_id ON product_images BEGIN
+            UPDATE products SET image_filename=(SELECT filename FROM product_images
+                                                WHERE product_id=products.id ORDER BY sort_order, id LIMIT 1)
+            WHERE id IN (OLD.product_id, NEW.product_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_products_cover_del AFTER DELETE ON product_images BEGIN
+            UPDATE products SET image_filename=(SELECT filename FROM product_images
+                                                WHERE product_id=OLD.product_id ORDER BY sort_order, id LIMIT 1)
+            WHERE id=OLD.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_product_ins AFTER INSERT ON products BEGIN
+            INSERT OR REPLACE INTO catalog (product_id, title, price_start, image_filename, is_sold, created_at)
+            VALUES (NEW.id, NEW.title, NEW.price_start, NEW.image_filename, NEW.is_sold, NEW.created_at);
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_product_upd AFTER UPDATE ON products BEGIN
+            UPDATE catalog SET title=NEW.title, price_start=NEW.price_start, image_filename=NEW.image_filename,
+                               is_sold=NEW.is_sold, created_at=NEW.created_at
+            WHERE product_id=NEW.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_product_del AFTER DELETE ON products BEGIN
+            DELETE FROM catalog WHERE product_id=OLD.id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_bid_ins AFTER INSERT ON bids BEGIN
+            UPDATE catalog SET highest_bid=MAX(COALESCE(highest_bid, NEW.amount), NEW.amount)
+            WHERE product_id=NEW.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_bid_del AFTER DELETE ON bids BEGIN
+            UPDATE catalog SET highest_bid=(SELECT MAX(amount) FROM bids WHERE product_id=OLD.product_id)
+            WHERE product_id=OLD.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_image_ins AFTER INSERT ON product_images BEGIN
+            UPDATE catalog SET
+                cover_filename=(SELECT COALESCE(thumb_filename, filename) FROM product_images
+                                WHERE product_id=NEW.product_id ORDER BY sort_order, id LIMIT 1),
+                img_count=(SELECT COUNT(*) FROM product_images WHERE product_id=NEW.product_id)
+            WHERE product_id=NEW.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_image_upd AFTER UPDATE ON product_images BEGIN
+            UPDATE catalog SET
+                cover_filename=(SELECT COALESCE(thumb_filename, filename) FROM product_images
+                                WHERE product_id=NEW.product_id ORDER BY sort_order, id LIMIT 1),
+                img_count=(SELECT COUNT(*) FROM product_images WHERE product_id=NEW.product_id)
+            WHERE product_id=NEW.product_id;
+        END;
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_image_del AFTER DELETE ON product_images BEGIN
+            UPDATE catalog SET
+                cover_filename=(SELECT COALESCE(thumb_filename, filename) FROM product_images
+                                WHERE product_id=OLD.product_id ORDER BY sort_order, id LIMIT 1),
+                img_count=(SELECT COUNT(*) FROM product_images WHERE product_id=OLD.product_id)
+            WHERE product_id=OLD.product_id;
+        END;
+        """)
+        conn.commit()
+
+        # migratie legacy cover -> product_images (één statement)
+        conn.execute("""
+          INSERT INTO product_images (product_id, filename, sort_order, created_at)
+          SELECT p.id, p.image_filename, 0, strftime('%Y-%m-%dT%H:%M:%f','now')
+          FROM products p
+          LEFT JOIN product_images pi ON pi.product_id = p.id
+          WHERE pi.id IS NULL AND p.image_filename IS NOT NULL AND p.image_filename != ''
+        """)
+
+        # catalog opnieuw opbouwen, voor het geval er buiten de triggers om iets is gewijzigd
+        conn.execute("BEGIN")
+        conn.execute("DELETE FROM catalog")
+        conn.execute("""
+          INSERT INTO catalog (product_id, title, price_start, image_filename, cover_filename, img_count, highest_bid, is_sold, created_at)
+          SELECT p.id, p.title, p.price_start, p.image_filename,
+                 (SELECT COALESCE(thumb_filename, filename) FROM product_images WHERE product_id=p.id ORDER BY sort_order, id LIMIT 1),
+                 (SELECT COUNT(*) FROM product_images WHERE product_id=p.id),
+                 (SELECT MAX(amount) FROM bids WHERE product_id=p.id),
+                 p.is_sold, p.created_at
+          FROM products p
+        """)
+        conn.commit()
 
 def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+    return filename.lower().endswith(_ALLOWED_SUFFIXES)
+
+def upload_name(filename):
+    # willekeurige naam met de oorspronkelijke extensie: botst praktisch nooit, dus geen zoektocht naar een vrije naam
+    # (extensie uit de ruwe naam, die allowed_file al heeft gecontroleerd; secure_filename zou bij "фото.jpg" de punt kwijtraken)
+    return uuid.uuid4().hex + os.path.splitext(filename)[1].lower()
+
+def reserve_upload(filename):
+    # maakt het bestand atomisch aan (O_EXCL); bij een botsing volgt name_1.ext, name_2.ext, ...
+    base, ext = os.path.splitext(filename)
+    i = 1
+    while True:
+        try:
+            fd = os.open(os.path.join(app.config["UPLOAD_FOLDER"], filename), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+            return filename, fd
+        except FileExistsError:
+            filename = f"{base}_{i}{ext}"
+            i += 1
+
+def _write_derived_image(filename, target_name, save):
+    # schrijft een bewerkte versie van een upload naar een vrije naam; None als Pillow het niet kan lezen
+    name, fd = reserve_upload(target_name)
+    path = os.path.join(app.config["UPLOAD_FOLDER"], name)
+    try:
+        with os.fdopen(fd, "wb") as out, Image.open(os.path.join(app.config["UPLOAD_FOLDER"], filename)) as img:
+            save(ImageOps.exif_transpose(img), out, img.format)
+        return name
+    except Exception as e:
+        print("Afbeelding fout:", e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+
+def convert_to_webp(filename):
+    # origineel vervangen door name.webp; gif (animaties) en webp blijven zoals ze zijn
+    base, ext = os.path.splitext(filename)
+    if ext.lower() in (".webp", ".gif"):
+        return filename
+    webp_name = _write_derived_image(filename, f"{base}.webp",
+                                     lambda img, out, fmt: img.save(out, format="WEBP", quality=82, method=6))
+    if not webp_name:
+        return filename
+    os.remove(os.path.join(app.config["UPLOAD_FOLDER"], filename))
+    return webp_name
+
+def make_thumbnail(filename):
+    # verkleinde kopie (name_thumb.ext) voor de collectiepagina; None als het niet lukt
+    base, ext = os.path.splitext(filename)
+    def save(img, out, fmt):
+        img.thumbnail(THUMB_SIZE)
+        img.save(out, format=fmt, quality=82, optimize=True)
+    return _write_derived_image(filename, f"{base}_thumb{ext}", save)
+
+def _save_upload(item):
+    file, fd, filename = item
+    file.stream.seek(0)  # een mislukte Cloudinary-upload kan de stream al gelezen hebben
+    with os.fdopen(fd, "wb") as out:
+        # grote buffer i.p.v. de 16KB van FileStorage.save: minder read/write-calls per foto
+        shutil.copyfileobj(file.stream, out, UPLOAD_COPY_BUFSIZE)
+    filename = convert_to_webp(filename)
+    return filename, make_thumbnail(filename)
+
+def store_uploads(uploads):
+    # geeft per upload (filename of CDN-URL, thumb) terug, in dezelfde volgorde
+    # met Cloudinary: alle foto's tegelijk uploaden; wat daar mislukt gaat alsnog lokaal
+    urls = [None] * len(uploads)
+    if CDN_ENABLED:
+        with ThreadPoolExecutor(max_workers=CDN_UPLOAD_WORKERS) as ex:
+            urls = list(ex.map(upload_to_cdn, uploads))
+
+    # eerst (serieel) namen reserveren, daarna parallel wegschrijven, naar WebP omzetten en thumbnails maken
+    pending = []
+    for file, url in zip(uploads, urls):
+        if url is None:
+            filename, fd = reserve_upload(upload_name(file.filename))
+            pending.append((file, fd, filename))
+
+    with ThreadPoolExecutor(max_workers=UPLOAD_SAVE_WORKERS) as ex:
+        local = iter(ex.map(_save_upload, pending))
+        return [(url, None) if url else next(local) for url in urls]
 
 def _email_config_snapshot():
     keys = ["SMTP_SERVER","SMTP_PORT","SMTP_USERNAME","FROM_EMAIL","ADMIN_EMAIL"]
-    return {k: os.getenv(k) for k in keys}
+    return {k: app.config[k] for k in keys}
 
-def send_email(subject, body):
-    smtp_server = os.getenv("SMTP_SERVER"); smtp_port = os.getenv("SMTP_PORT")
-    smtp_user = os.getenv("SMTP_USERNAME"); smtp_pass = os.getenv("SMTP_PASSWORD")
-    from_email = os.getenv("FROM_EMAIL");   admin_email = os.getenv("ADMIN_EMAIL")
-    if not all([smtp_server, smtp_port, smtp_user, smtp_pass, from_email, admin_email]):
+# --- SMTP: één verbinding hergebruiken i.p.v. per mail opnieuw inloggen ---
+_smtp_lock = threading.Lock()
+_smtp_conn = None
+
+def _smtp_connection():
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except smtplib.SMTPServerDisconnected:
+            pass
+        _close_smtp()
+    # timeout: een hangende server mag de mail-worker (en de wachtrij erachter) niet eeuwig blokkeren
+    server = smtplib.SMTP(app.config["SMTP_SERVER"], app.config["SMTP_PORT"], timeout=SMTP_TIMEOUT)
+    server.starttls(); server.login(app.config["SMTP_USERNAME"], app.config["SMTP_PASSWORD"])
+    _smtp_conn = server
+    return server
+
+def _close_smtp():
+    global _smtp_conn
+    server, _smtp_conn = _smtp_conn, None
+    if server is not None:
+        try:
+            server.quit()
+        except Exception:
+            pass
+
+atexit.register(_close_smtp)
+
+def _send_email_blocking(subject, body):
+    if not app.config["EMAIL_ENABLED"]:
         return False
     msg = EmailMessage()
-    msg["Subject"] = subject; msg["From"] = from_email; msg["To"] = admin_email
+    msg["Subject"] = subject; msg["From"] = app.config["FROM_EMAIL"]; msg["To"] = app.config["ADMIN_EMAIL"]
     msg.set_content(body)
-    try:
-        with smtplib.SMTP(smtp_server, int(smtp_port)) as server:
-            server.starttls(); server.login(smtp_user, smtp_pass); server.send_message(msg)
-        return True
-    except Exception as e:
-        print("Email error:", e); return False
-
-
-def cover_images_map(conn, product_ids):
-    if not product_ids:
-        return {}
-    placeholders = ",".join(["?"] * len(product_ids))
-    sql = f"""
-      SELECT pi.product_id, pi.filename
-      FROM product_images pi
-      JOIN (
-        SELECT product_id, MIN(sort_order) AS ms, MIN(id) AS mid
-        FROM product_images
-        WHERE product_id IN ({placeholders})
-        GROUP BY product_id
-      ) x ON x.product_id = pi.product_id AND pi.sort_order = x.ms
-      GROUP BY pi.product_id
-    """
-    rows = conn.execute(sql, product_ids).fetchall()
-    return {row["product_id"]: row["filename"] for row in rows}
-
-
-
-def images_count_map(conn, product_ids):
-    # open een eigen verbinding zodat we nooit op een gesloten conn werken
-    if not product_ids:
-        return {}
-    c = get_db()
-    try:
-        placeholders = ",".join(["?"]*len(product_ids))
-        sql = f"SELECT product_id, COUNT(*) AS cnt FROM product_images WHERE product_id IN ({placeholders}) GROUP BY product_id"
-        rows = c.execute(sql, product_ids).fetchall()
-        return {row["product_id"]: row["cnt"] for row in rows}
-    finally:
-        c.close()
+    with _smtp_lock:
+        # bij een fout de verbinding weggooien en één keer opnieuw proberen met een verse verbinding
+        for attempt in (1, 2):
+            try:
+                server = _smtp_connection()
+                server.send_message(msg)
+                return True
+            except Exception as e:
+                _close_smtp()
+                if attempt == 2:
+                    print("Email error:", e); return False
+
+# --- Mails versturen buiten de request om ---
+_email_queue = queue.Queue()
+_email_worker = None
+_email_worker_lock = threading.Lock()
+
+def _email_worker_loop():
+    while True:
+        subject, body = _email_queue.get()
+        try:
+            _send_email_blocking(subject, body)
+        except Exception as e:
+            print("Email error:", e)
+        finally:
+            _email_queue.task_done()
 
-def all_images(conn, pid):
-    return conn.execute("SELECT * FROM product_images WHERE product_id=? ORDER BY sort_order, id", (pid,)).fetchall()
+def send_email(subject, body):
+    # zet de mail in de wachtrij; de worker (met vaste SMTP-verbinding) verstuurt hem
+    global _email_worker
+    if not app.config["EMAIL_ENABLED"]:
+        return False
+    with _email_worker_lock:
+        if _email_worker is None or not _email_worker.is_alive():
+            _email_worker = threading.Thread(target=_email_worker_loop, name="email-worker", daemon=True)
+            _email_worker.start()
+    _email_queue.put((subject, body))
+    return True
 
-def update_cover(conn, pid):
-    row = conn.execute("SELECT filename FROM product_images WHERE product_id=? ORDER BY sort_order, id LIMIT 1", (pid,)).fetchone()
-    cover = row["filename"] if row else None
-    conn.execute("UPDATE products SET image_filename=? WHERE id=?", (cover, pid))
-    conn.commit()
 
 @app.route("/")
 def index():
-    conn = get_db()
-    products = conn.execute("SELECT * FROM products ORDER BY is_sold ASC, created_at DESC").fetchall()
-    pids = [str(p["id"]) for p in products]
-    highest = {}
-    if pids:
-        q = f"SELECT product_id, MAX(amount) as max_amount FROM bids WHERE product_id IN ({','.join(['?']*len(pids))}) GROUP BY product_id"
-        rows = conn.execute(q, pids).fetchall()
-        highest = {row["product_id"]: row["max_amount"] for row in rows}
-    covers = cover_images_map(conn, pids)
-    conn.close()
-    image_counts = images_count_map(conn, pids)
-    return render_template("index.html", products=products, highest=highest, covers=covers, image_counts=image_counts)
+    # zelfde HTML -> zelfde ETag; een terugkerende browser krijgt dan alleen een 304
+    resp = _render_index()
+    etag = resp.get_etag()[0]
+    # Flask-Compress maakt er "etag:gzip" / "etag:br" van; die varianten zijn dezelfde pagina
+    if any(tag.split(":", 1)[0] == etag for tag in request.if_none_match.as_set()):
+        not_modified = make_response("", 304)
+        not_modified.set_etag(etag)
+        not_modified.cache_control.no_cache = True
+        return not_modified
+    return resp.make_conditional(request)
+
+@cache.cached(timeout=60, key_prefix=_index_cache_key, unless=_has_pending_flash)
+def _render_index():
+    # cover, aantal foto's en hoogste bod staan al in catalog (bijgehouden door triggers)
+    with get_db() as conn:
+        products = conn.execute(SQL_INDEX_CATALOG).fetchall()
+    resp = make_response(render_template("index.html", products=products))
+    resp.add_etag()
+    resp.cache_control.no_cache = True
+    return resp
 
 @app.route("/product/<int:pid>")
 def product_detail(pid):
-    conn = get_db()
-    product = conn.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
+    with get_db() as conn:
+        product = conn.execute(SQL_PRODUCT_DETAIL, (pid,)).fetchone()
     if not product: abort(404)
-    bids = conn.execute("SELECT * FROM bids WHERE product_id=? ORDER BY amount DESC, created_at ASC", (pid,)).fetchall()
+    bids = json.loads(product["bids_json"])
+    images = json.loads(product["images_json"])
     highest = bids[0]["amount"] if bids else None
-    images = all_images(conn, pid)
-    conn.close()
     return render_template("product.html", product=product, bids=bids, highest=highest, images=images)
 
 @app.route("/product/<int:pid>/bid", methods=["POST"])
@@ -224,32 +589,23 @@ def place_bid(pid):
         flash("Bedrag is ongeldig.", "error")
         return redirect(url_for("product_detail", pid=pid))
 
-    conn = get_db()
-    try:
-        product = conn.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
+    with get_db() as conn:
+        product = conn.execute(SQL_PRODUCT, (pid,)).fetchone()
         if not product:
             flash("Product niet gevonden.", "error")
             return redirect(url_for("index"))
 
-        # huidige hoogste bod bepalen
-        highest_row = conn.execute("SELECT MAX(amount) as max_amount FROM bids WHERE product_id=?", (pid,)).fetchone()
-        current_highest = highest_row["max_amount"] if highest_row and highest_row["max_amount"] is not None else product["price_start"]
-
-        if amount <= current_highest:
+        # bod opslaan; atomisch, zodat twee gelijktijdige biedingen niet allebei de controle passeren
+        cur = conn.execute(SQL_INSERT_BID, (pid, name, email, amount, amount, pid, pid))
+        conn.commit()
+        if cur.rowcount == 0:
+            highest_row = conn.execute(SQL_MAX_BID, (pid,)).fetchone()
+            current_highest = highest_row["max_amount"] if highest_row and highest_row["max_amount"] is not None else product["price_start"]
             flash(f"Je bod moet hoger zijn dan €{current_highest:.2f}.", "error")
             return redirect(url_for("product_detail", pid=pid))
+    invalidate_index_cache()
 
-        # bod opslaan
-        conn.execute(
-            "INSERT INTO bids (product_id, name, email, amount, created_at) VALUES (?,?,?,?,?)",
-            (pid, name, email, amount, datetime.utcnow().isoformat())
-        )
-        conn.commit()
-
-    finally:
-        conn.close()
-
-    # mail sturen (best effort)
+    # mail sturen (best effort, op de achtergrond)
     try:
         send_email(
             subject=f"Nieuw bod op {product['title']}",
@@ -261,35 +617,12 @@ def place_bid(pid):
     flash("Je bod is geplaatst! We nemen contact op als je wint.", "success")
     return redirect(url_for("product_detail", pid=pid))
 
-    name = request.form.get("name","").strip()
-    email = request.form.get("email","").strip()
-    amount = request.form.get("amount","").strip()
-    if not name or not email or not amount:
-        flash("Vul alle velden in.", "error"); return redirect(url_for("product_detail", pid=pid))
-    try: amount = float(amount.replace(",", "."))
-    except ValueError:
-        flash("Bedrag is ongeldig.", "error"); return redirect(url_for("product_detail", pid=pid))
-    conn = get_db()
-    product = conn.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
-    if not product: conn.close(); abort(404)
-    highest_row = conn.execute("SELECT MAX(amount) as max_amount FROM bids WHERE product_id=?", (pid,)).fetchone()
-    current_highest = highest_row["max_amount"] if highest_row and highest_row["max_amount"] is not None else product["price_start"]
-    if amount <= current_highest:
-        flash(f"Je bod moet hoger zijn dan €{current_highest:.2f}.", "error"); conn.close(); return redirect(url_for("product_detail", pid=pid))
-    conn.execute("INSERT INTO bids (product_id, name, email, amount, created_at) VALUES (?,?,?,?,?)",
-                 (pid, name, email, amount, datetime.utcnow().isoformat()))
-    conn.commit(); conn.close()
-    ok_mail = send_email(
-        subject=f"Nieuw bod op {product['title']}",
-        body=f"Er is een nieuw bod van €{amount:.2f} door {name} ({email}) op product #{pid} - {product['title']}"
-    )
-    print("[BID EMAIL]", {"product_id": pid, "amount": amount, "bidder": email, "mail_ok": ok_mail})
 @app.route("/admin", methods=["GET", "POST"], endpoint="admin")
 def admin():
     
-    admin_password = os.getenv("ADMIN_PASSWORD", "")
     if request.method == "POST" and request.form.get("action") == "login":
-        if request.form.get("password") != admin_password:
+        pw_hash = hashlib.sha256(request.form.get("password", "").encode()).digest()
+        if not hmac.compare_digest(ADMIN_PW_HASH, pw_hash):
             flash("Onjuist wachtwoord.", "error")
         else:
             session["is_admin"] = True; flash("Ingelogd als admin.", "success"); return redirect(url_for("admin"))
@@ -306,44 +639,34 @@ def admin():
         try: price_start = float(price_start.replace(",", "."))
         except ValueError: flash("Startprijs ongeldig.", "error"); return redirect(url_for("admin"))
 
-        saved_files = []
-        for file in images:
-            if not file or file.filename=="":
-                continue
+        uploads = [f for f in images if f and f.filename!=""]
+        for file in uploads:
             if not allowed_file(file.filename):
                 flash(f"Bestandstype niet toegestaan: {file.filename}", "error"); return redirect(url_for("admin"))
-            filename = secure_filename(file.filename)
-            base, ext = os.path.splitext(filename)
-            save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-            i=1
-            while os.path.exists(save_path):
-                filename = f"{base}_{i}{ext}"
-                save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                i+=1
-            file.save(save_path)
-            saved_files.append(filename)
-
-        if not saved_files:
+
+        if not uploads:
             flash("Upload minimaal één geldige afbeelding.", "error"); return redirect(url_for("admin"))
 
-        conn = get_db()
-        conn.execute("INSERT INTO products (title, description, price_start, image_filename, created_at) VALUES (?,?,?,?,?)",
-                     (title, description, float(price_start), saved_files[0], datetime.utcnow().isoformat()))
-        pid = conn.execute("SELECT last_insert_rowid() as lid").fetchone()["lid"]
-        for idx, fn in enumerate(saved_files):
-            conn.execute("INSERT INTO product_images (product_id, filename, sort_order, created_at) VALUES (?,?,?,?)",
-                         (pid, fn, idx, datetime.utcnow().isoformat()))
-        conn.commit(); conn.close()
+        saved = store_uploads(uploads)
+        with get_db() as conn:
+            conn.execute("BEGIN")
+            cur = conn.execute(SQL_INSERT_PRODUCT, (title, description, float(price_start), saved[0][0]))
+            pid = cur.lastrowid
+            conn.executemany(SQL_INSERT_PRODUCT_IMAGE, [(pid, fn, thumb, idx) for idx, (fn, thumb) in enumerate(saved)])
+            conn.commit()
+        invalidate_index_cache()
         flash("Product met afbeeldingen toegevoegd.", "success")
         return redirect(url_for("admin"))
 
-    conn = get_db()
-    products = conn.execute("SELECT * FROM products ORDER BY created_at DESC").fetchall()
-    bids_by_product = {}
-    for p in products:
-        bids = conn.execute("SELECT * FROM bids WHERE product_id=? ORDER BY amount DESC", (p["id"],)).fetchall()
-        bids_by_product[p["id"]] = bids
-    conn.close()
+    with get_db() as conn:
+        # één leestransactie: producten en biedingen uit dezelfde snapshot
+        conn.execute("BEGIN")
+        products = conn.execute(SQL_ADMIN_PRODUCTS).fetchall()
+        bids_by_product = {p["id"]: [] for p in products}
+        # alle biedingen in één query, daarna per product groeperen
+        for r in conn.execute(SQL_ADMIN_BIDS).fetchall():
+            bids_by_product.setdefault(r["product_id"], []).append(r)
+        conn.commit()
     return render_template("admin.html", products=products, bids_by_product=bids_by_product)
 
 @app.route("/admin/edit/<int:pid>", methods=["GET","POST"])
@@ -352,52 +675,9 @@ def admin_edit(pid):
     if not flask.session.get("is_admin"):
         abort(403)
 
-    conn = get_db()
-    cur = conn.cursor()
-    product = cur.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
-    if not product:
-        conn.close()
-        flash("Product niet gevonden.", "error")
-        return redirect(url_for("admin"))
-
-    if request.method == "POST":
-        title = request.form.get("title","").strip()
-        description = request.form.get("description","").strip()
-        price_start = request.form.get("price_start","").strip()
-        is_sold = 1 if request.form.get("is_sold") == "on" else 0
-
-        if not title:
-            flash("Titel is verplicht.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        try:
-            price_start = float(price_start.replace(",", ".")) if price_start else product["price_start"]
-        except ValueError:
-            flash("Startprijs ongeldig.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        cur.execute(
-            "UPDATE products SET title=?, description=?, price_start=?, is_sold=? WHERE id=?",
-            (title or product["title"], description, price_start, is_sold, pid)
-        )
-        conn.commit()
-        conn.close()
-        flash("Product bijgewerkt.", "success")
-        return redirect(url_for("admin_edit", pid=pid))
-
-    conn.close()
-    return render_template("admin_edit.html", product=product)
-
-    if not flask.session.get("is_admin"):
-        abort(403)
-
-    conn = get_db()
-    cur = conn.cursor()
-    product = cur.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
+    with get_db() as conn:
+        product = conn.execute(SQL_PRODUCT, (pid,)).fetchone()
     if not product:
-        conn.close()
         flash("Product niet gevonden.", "error")
         return redirect(url_for("admin"))
 
@@ -409,176 +689,63 @@ def admin_edit(pid):
 
         if not title:
             flash("Titel is verplicht.", "error")
-            conn.close()
             return redirect(url_for("admin_edit", pid=pid))
 
         try:
             price_start = float(price_start.replace(",", ".")) if price_start else product["price_start"]
         except ValueError:
             flash("Startprijs ongeldig.", "error")
-            conn.close()
             return redirect(url_for("admin_edit", pid=pid))
 
-        # Update velden
-        cur.execute(
-            "UPDATE products SET title=?, description=?, price_start=?, is_sold=? WHERE id=?",
-            (title or product["title"], description, price_start, is_sold, pid)
-        )
-        conn.commit()
-        conn.close()
-        flash("Product bijgewerkt.", "success")
-        return redirect(url_for("admin_edit", pid=pid))
-
-    conn.close()
-    return render_template("admin_edit.html", product=product)
-
-    if not flask.session.get("is_admin"):
-        abort(403)
-
-    conn = get_db()
-    cur = conn.cursor()
-    product = cur.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
-    if not product:
-        conn.close()
-        flash("Product niet gevonden.", "error")
-        return redirect(url_for("admin"))
-
-    if request.method == "POST":
-        title = request.form.get("title","").strip()
-        description = request.form.get("description","").strip()
-        price_start = request.form.get("price_start","").strip()
-        is_sold = 1 if request.form.get("is_sold") == "on" else 0
-
-        if not title:
-            flash("Titel is verplicht.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        try:
-            price_start = float(price_start.replace(",", ".")) if price_start else product["price_start"]
-        except ValueError:
-            flash("Startprijs ongeldig.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        cur.execute(
-            "UPDATE products SET title=?, description=?, price_start=?, is_sold=? WHERE id=?",
-            (title or product["title"], description, price_start, is_sold, pid)
-        )
-        conn.commit()
-        conn.close()
-        flash("Product bijgewerkt.", "success")
-        return redirect(url_for("admin_edit", pid=pid))
-
-    conn.close()
-    return render_template("admin_edit.html", product=product)
-
-    from flask import session
-    if not flask.session.get("is_admin"):
-        abort(403)
-
-    conn = get_db()
-    cur = conn.cursor()
-
-    # product ophalen
-    product = cur.execute("SELECT * FROM products WHERE id=?", (pid,)).fetchone()
-    if not product:
-        conn.close()
-        flash("Product niet gevonden.", "error")
-        return redirect(url_for("admin"))
-
-    if request.method == "POST":
-        title = request.form.get("title","").strip()
-        description = request.form.get("description","").strip()
-        price_start = request.form.get("price_start","").strip()
-        is_sold = 1 if request.form.get("is_sold") == "on" else 0
-
-        if not title:
-            flash("Titel is verplicht.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        try:
-            price_start = float(price_start.replace(",", ".")) if price_start else product["price_start"]
-        except ValueError:
-            flash("Startprijs ongeldig.", "error")
-            conn.close()
-            return redirect(url_for("admin_edit", pid=pid))
-
-        # velden bijwerken
-        cur.execute(
-            "UPDATE products SET title=?, description=?, price_start=?, is_sold=? WHERE id=?",
-            (title or product["title"], description, price_start, is_sold, pid)
-        )
-        conn.commit()
-
-        # Optioneel: extra foto's toevoegen als er een product_images tabel is
-        try:
-            cols = cur.execute("PRAGMA table_info(product_images)").fetchall()
-            has_images = bool(cols)
-        except Exception:
-            has_images = False
-
-        if has_images:
-            files = request.files.getlist("images")
-            saved = 0
-            for f in files:
-                if not f or not getattr(f, "filename", ""):
-                    continue
-                # Probeer Cloudinary, anders lokaal
-                url = None
-                try:
-                    if 'upload_to_cdn' in globals():
-                        url = upload_to_cdn(f, public_id_prefix="nofa")
-                except Exception:
-                    url = None
-                if url:
-                    filename = url
-                else:
-                    # lokaal opslaan
-                    if not allowed_file(f.filename):
-                        continue
-                    from werkzeug.utils import secure_filename
-                    import os
-                    filename = secure_filename(f.filename)
-                    save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                    base, ext = os.path.splitext(filename); i=1
-                    while os.path.exists(save_path):
-                        filename = f"{base}_{i}{ext}"; save_path = os.path.join(app.config["UPLOAD_FOLDER"], filename); i+=1
-                    f.save(save_path)
-                # sort_order bepalen
-                rowo = cur.execute("SELECT COALESCE(MAX(sort_order), -1) as maxo FROM product_images WHERE product_id=?", (pid,)).fetchone()
-                next_order = (rowo["maxo"] + 1) if rowo else 0
-                cur.execute(
-                    "INSERT INTO product_images (product_id, filename, sort_order, created_at) VALUES (?,?,?,?)",
-                    (pid, filename, next_order, datetime.utcnow().isoformat())
-                )
-                saved += 1
-            if saved:
-                conn.commit()
-
-        conn.close()
+        # extra foto's (optioneel) komen achteraan
+        uploads = [f for f in request.files.getlist("images") if f and f.filename]
+        for file in uploads:
+            if not allowed_file(file.filename):
+                flash(f"Bestandstype niet toegestaan: {file.filename}", "error")
+                return redirect(url_for("admin_edit", pid=pid))
+        saved = store_uploads(uploads)
+
+        with get_db() as conn:
+            conn.execute("BEGIN")
+            conn.execute(
+                "UPDATE products SET title=?, description=?, price_start=?, is_sold=? WHERE id=?",
+                (title or product["title"], description, price_start, is_sold, pid)
+            )
+            conn.executemany(SQL_APPEND_PRODUCT_IMAGE, [(pid, fn, thumb, pid) for fn, thumb in saved])
+            conn.commit()
+        invalidate_index_cache()
         flash("Product bijgewerkt.", "success")
         return redirect(url_for("admin_edit", pid=pid))
 
-    conn.close()
     return render_template("admin_edit.html", product=product)
 
-
-
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename):
-    return send_from_directory(UPLOAD_DIR, filename)
+    prefix = app.config["UPLOAD_ACCEL_PREFIX"]
+    if prefix:
+        # Nginx levert het bestand via X-Accel-Redirect; Flask controleert alleen het pad
+        if safe_join(UPLOAD_DIR, filename) is None:
+            abort(404)
+        resp = make_response("")
+        resp.mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        resp.headers["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + quote(filename)
+    else:
+        resp = send_from_directory(UPLOAD_DIR, filename, max_age=UPLOAD_MAX_AGE)
+    # uploadnamen zijn uniek (uuid) en worden nooit hergebruikt: een jaar bewaren, zonder revalidatie
+    resp.cache_control.public = True
+    resp.cache_control.max_age = UPLOAD_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp
 
 @app.route("/admin/mark_sold/<int:pid>", methods=["POST"])
 def mark_sold(pid):
     
     if not flask.session.get("is_admin"):
         abort(403)
-    conn = get_db()
-    conn.execute("UPDATE products SET is_sold=1 WHERE id=?", (pid,))
-    conn.commit()
-    conn.close()
+    with get_db() as conn:
+        conn.execute("UPDATE products SET is_sold=1 WHERE id=?", (pid,))
+        conn.commit()
+    invalidate_index_cache()
     flash("Product gemarkeerd als verkocht.", "success")
     return redirect(url_for("admin"))
 
@@ -588,43 +755,37 @@ def admin_delete_product(pid):
     if not flask.session.get("is_admin"):
         abort(403)
 
-    conn = get_db()
-    cur = conn.cursor()
+    with get_db() as conn:
+        cur = conn.cursor()
 
-    # Bestaan er extra afbeeldingen?
-    has_images = False
-    try:
-        cols = cur.execute("PRAGMA table_info(product_images)").fetchall()
-        has_images = bool(cols)
-    except Exception:
+        # Bestaan er extra afbeeldingen?
         has_images = False
+        try:
+            cols = cur.execute("PRAGMA table_info(product_images)").fetchall()
+            has_images = bool(cols)
+        except Exception:
+            has_images = False
 
-    # Verzamel alle bestandsnamen die lokaal kunnen staan
-    to_delete = []
-
-    # hoofdafbeelding van product
-    row = cur.execute("SELECT image_filename FROM products WHERE id=?", (pid,)).fetchone()
-    if row and row["image_filename"]:
-        to_delete.append(row["image_filename"])
-
-    # extra afbeeldingen
-    if has_images:
-        rows = cur.execute("SELECT filename FROM product_images WHERE product_id=?", (pid,)).fetchall()
-        for r in rows:
-            if r["filename"]:
-                to_delete.append(r["filename"])
+        # Verzamel alle bestandsnamen die lokaal kunnen staan
+        to_delete = []
 
-    # Verwijder biedingen
-    cur.execute("DELETE FROM bids WHERE product_id=?", (pid,))
+        # hoofdafbeelding van product
+        row = cur.execute("SELECT image_filename FROM products WHERE id=?", (pid,)).fetchone()
+        if row and row["image_filename"]:
+            to_delete.append(row["image_filename"])
 
-    # Verwijder extra afbeeldingen records
-    if has_images:
-        cur.execute("DELETE FROM product_images WHERE product_id=?", (pid,))
+        # extra afbeeldingen
+        if has_images:
+            rows = cur.execute("SELECT filename, thumb_filename FROM product_images WHERE product_id=?", (pid,)).fetchall()
+            for r in rows:
+                if r["filename"]:
+                    to_delete.append(r["filename"])
+                if r["thumb_filename"]:
+                    to_delete.append(r["thumb_filename"])
 
-    # Verwijder product
-    cur.execute("DELETE FROM products WHERE id=?", (pid,))
-    conn.commit()
-    conn.close()
+        # Verwijder product; biedingen en afbeeldingen gaan mee via trg_products_cascade_after_del
+        cur.execute("DELETE FROM products WHERE id=?", (pid,))
+    invalidate_index_cache()
 
     # Probeer lokale bestanden te verwijderen (geen http/https)
     import os
@@ -643,6 +804,8 @@ def admin_delete_product(pid):
     return redirect(url_for("admin"))
 
 
+# ook onder gunicorn: schema, indexen, triggers en catalog bijwerken bij het opstarten
+init_db()
+
 if __name__ == "__main__":
-    init_db()
     app.run(host="0.0.0.0", port=int(os.getenv("PORT", 5000)), debug=True)
\ No newline at end of file
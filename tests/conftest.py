@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# de tests mogen store.db in de repo niet aanraken: eigen database in een tijdelijke map
+os.environ.setdefault("DB_PATH", os.path.join(tempfile.mkdtemp(), "test.db"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
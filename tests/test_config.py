@@ -0,0 +1,11 @@
+import app as shop
+
+
+def test_invalid_smtp_port_disables_email(monkeypatch):
+    monkeypatch.setenv("SMTP_PORT", "58x")
+    assert shop._smtp_port() == 0
+
+
+def test_smtp_port_parses_number(monkeypatch):
+    monkeypatch.setenv("SMTP_PORT", "587")
+    assert shop._smtp_port() == 587
@@ -0,0 +1,28 @@
+import io
+import os
+
+import app as shop
+
+
+def test_upload_name_keeps_extension_of_non_ascii_filename():
+    name = shop.upload_name("фото.GIF")
+    base, ext = os.path.splitext(name)
+    assert ext == ".gif"
+    assert len(base) == 32
+
+
+def test_add_product_keeps_non_ascii_gif_as_gif(tmp_path, monkeypatch):
+    monkeypatch.setitem(shop.app.config, "UPLOAD_FOLDER", str(tmp_path))
+    gif = io.BytesIO()
+    shop.Image.new("RGB", (8, 8), "red").save(gif, format="GIF")
+    gif.seek(0)
+    client = shop.app.test_client()
+    with client.session_transaction() as sess:
+        sess["is_admin"] = True
+    resp = client.post("/admin", data={"action": "add_product", "title": "Test", "price_start": "1",
+                                       "images": [(gif, "фото.gif")]},
+                       content_type="multipart/form-data")
+    assert resp.status_code == 302
+    saved = sorted(os.listdir(tmp_path))
+    # gif blijft gif (geen WebP-conversie), ook met een niet-ASCII naam
+    assert len(saved) == 2 and all(fn.endswith(".gif") for fn in saved)